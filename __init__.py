@@ -5,8 +5,4 @@
 # LICENSE file in the root directory of this source tree. An additional grant
 # of patent rights can be found in the PATENTS file in the same directory.
 
-from __future__ import absolute_import
-from __future__ import division
-from __future__ import print_function
-from __future__ import unicode_literals
 __all__ = ['netlink', 'ipvs', 'taskstats', 'cgroupstats']
@@ -10,36 +10,33 @@
 This module exists to expose the cgroupstats api to python
 """
 
-from __future__ import absolute_import
-from __future__ import division
-from __future__ import print_function
-
-# @lint-avoid-python-3-compatibility-imports
-# from __future__ import unicode_literals
-
 from contextlib import contextmanager
 import os
 import struct
 import gnlpy.netlink as netlink
 
+# as per Cgroupstats.__fields__ below, and they're uint64 each
+_CG_ST = struct.Struct('QQQQQ')
+
 
 class Cgroupstats(object):
     __fields__ = [
         'nr_sleeping', 'nr_running', 'nr_stopped',
         'nr_uninterruptible', 'nr_iowait'
     ]
+    __slots__ = tuple(__fields__)
 
     def __init__(self, **kwargs):
-        self.__dict__.update(kwargs)
+        for k, v in kwargs.items():
+            setattr(self, k, v)
 
     def __repr__(self):
-        arr = ['%s=%s' % (f, repr(self.__dict__[f])) for f in self.__fields__]
+        arr = ['%s=%s' % (f, repr(getattr(self, f))) for f in self.__fields__]
         return 'Cgroupstats(%s)' % ', '.join(arr)
 
     @staticmethod
     def unpack(val):
-        fmt = 'QQQQQ'  # as per __fields__ above, and they're uint64 each
-        attrs = dict(zip(Cgroupstats.__fields__, struct.unpack(fmt, val)))
+        attrs = dict(zip(Cgroupstats.__fields__, _CG_ST.unpack(val)))
         return Cgroupstats(**attrs)
 
 
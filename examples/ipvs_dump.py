@@ -5,11 +5,6 @@
 # LICENSE file in the root directory of this source tree. An additional grant
 # of patent rights can be found in the PATENTS file in the same directory.
 
-from __future__ import absolute_import
-from __future__ import division
-from __future__ import print_function
-from __future__ import unicode_literals
-
 import sys
 import argparse
 import re
@@ -17,25 +12,32 @@ import socket
 from gnlpy.ipvs import IpvsClient
 
 
-def ip_string_eq(ip1, ip2):
-    def fam(ip):
-        return socket.AF_INET6 if ':' in ip else socket.AF_INET
-    f1, f2 = fam(ip1), fam(ip2)
-    return f1 == f2 and socket.inet_pton(f1, ip1) == socket.inet_pton(f2, ip2)
+_RE_V6_PORT = re.compile(r"^\[([a-fA-F0-9:]+)\]:(\d+)$")
+_RE_V4_PORT = re.compile(r"^([\d\.]+):(\d+)$")
+_RE_V6 = re.compile(r"^\[?([a-fA-F0-9:]+)\]?$")
+_RE_V4 = re.compile(r"^([\d\.]+)$")
 
 
-def match_arg(s, ip, port):
-    m = re.match(r"^\[([a-fA-F0-9:]+)\]:(\d+)$", s)
-    m = m or re.match(r"^([\d\.]+):(\d+)$", s)
+def parse_arg(s):
+    """Parse an address argument into the canonical form of its ip and its
+    port, or None if no port was given.
+    """
+    m = _RE_V6_PORT.match(s) or _RE_V4_PORT.match(s)
     if m:
-        return ip_string_eq(m.group(1), ip) and int(m.group(2)) == port
+        ip, port = m.group(1), int(m.group(2))
+    else:
+        m = _RE_V6.match(s) or _RE_V4.match(s)
+        if not m:
+            raise Exception("malformed address: " + s)
+        ip, port = m.group(1), None
+    fam = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    return socket.inet_ntop(fam, socket.inet_pton(fam, ip)), port
 
-    m = re.match(r"^\[?([a-fA-F0-9:]+)\]?$", s)
-    m = m or re.match(r"^([\d\.]+)$", s)
-    if m:
-        return ip_string_eq(m.group(1), ip)
 
-    raise Exception("malformed address: " + s)
+def match_arg(arg, ip, port):
+    # The addresses reported by the kernel are already canonical, so once the
+    # argument is parsed matching is just a comparison.
+    return arg[0] == ip and (arg[1] is None or arg[1] == port)
 
 
 def main(argv):
@@ -45,20 +47,25 @@ def main(argv):
     parser.add_argument('-d', '--dest', default=None,
                         help='destination to dump')
     args = parser.parse_args(argv[1:])
+    if args.service is not None:
+        args.service = parse_arg(args.service)
+    if args.dest is not None:
+        args.dest = parse_arg(args.dest)
     pools = IpvsClient().get_pools()
     for p in pools:
         s = p.service()
+        port = s.port_
         if args.service is not None or args.dest is not None:
             if (args.service is not None and
-                    not match_arg(args.service, s.vip(), s.port())):
+                    not match_arg(args.service, s.vip_, port)):
                 continue
             if (args.dest is not None and
-                not any([match_arg(args.dest, d.ip(), s.port())
-                         for d in p.dests()])):
+                not any(match_arg(args.dest, d.ip_, port)
+                        for d in p.dests())):
                 continue
         print(s)
         for d in p.dests():
-            if args.dest is None or match_arg(args.dest, d.ip(), s.port()):
+            if args.dest is None or match_arg(args.dest, d.ip_, port):
                 print('->', d)
 
 
@@ -10,23 +10,22 @@
 This module exists as a pure-python replacement for ipvsadm.
 """
 
-from __future__ import absolute_import
-from __future__ import division
-from __future__ import print_function
-from __future__ import unicode_literals
-
-import six
+import contextlib
+import functools
 import socket
 import struct
+import threading
+import types
 import gnlpy.netlink as netlink
 
+
 # IPVS forwarding methods
 IPVS_MASQUERADING = 0
 IPVS_LOCAL = 1
 IPVS_TUNNELING = 2
 IPVS_ROUTING = 3
 
-IPVS_METHODS = set([
+IPVS_METHODS = frozenset([
     IPVS_MASQUERADING,
     IPVS_LOCAL,
     IPVS_TUNNELING,
@@ -36,10 +35,18 @@ IPVS_METHODS = set([
 # Virtual Service flags
 IPVS_SVC_F_ONEPACKET = 0x0004
 
+# Pads an IPv4 address to the size of the kernel's union nf_inet_addr
+_V4_PAD = b'\0' * 12
+
+# struct ip_vs_flags: the flags to set followed by the mask of flags to change
+_FLAGS_ST = struct.Struct('=II')
+_ZERO_FLAGS = b'\0' * 8
+
 # These are attr_list_types which are nestable.  The command attribute list
 # is ultimately referenced by the messages which are passed down to the
 # kernel via netlink.  These structures must match the type and ordering
-# that the kernel expects.
+# that the kernel expects.  The service and dest lists are built on the hot
+# paths with from_tuple(), which takes the values in that same order.
 
 IpvsStatsAttrList = netlink.create_attr_list_type(
     'IpvsStatsAttrList',
@@ -149,69 +156,117 @@ IpvsMessage = netlink.create_genl_message_type(
 
 
 def verbose(f):
+    @functools.wraps(f)
     def g(self, *args, **kwargs):
         if self.verbose:
             s_args = [repr(a) for a in args]
             s_args.extend(['{0}={1}'.format(k, repr(v))
-                           for k, v in six.iteritems(kwargs)])
+                           for k, v in kwargs.items()])
             print('{0}({1})'.format(f.__name__, ', '.join(s_args)))
         return f(self, *args, **kwargs)
+    # Lets IpvsClient find the undecorated method when it isn't verbose.
+    g._quiet = f
     return g
 
 
+# Module-level aliases spare the socket attribute lookup on each call.
+_inet_pton = socket.inet_pton
+_inet_ntop = socket.inet_ntop
+
+
+# The helpers below are pure and keep being called with the same handful of
+# VIPs and RIPs, so memoize them.
+@functools.lru_cache(maxsize=4096)
+def _to_af(ip):
+    # An IPv6 address always has a colon within its first 5 characters.
+    return socket.AF_INET6 if ip.find(':', 0, 5) != -1 else socket.AF_INET
+
+
+@functools.lru_cache(maxsize=4096)
+def _to_af_union(ip):
+    # Same test as _to_af, inlined since this is the hotter of the two.
+    if ip.find(':', 0, 5) == -1:
+        return socket.AF_INET, _inet_pton(socket.AF_INET, ip) + _V4_PAD
+    return socket.AF_INET6, _inet_pton(socket.AF_INET6, ip)
+
+
 def _validate_ip(ip):
+    # Parsing through _to_af_union means a validated address is already in
+    # its cache by the time to_attr_list() packs it.
     try:
-        socket.inet_pton(_to_af(ip), ip)
+        _to_af_union(ip)
         return True
     except socket.error:
         return False
 
 
-def _to_af(ip):
-    return socket.AF_INET6 if ':' in ip else socket.AF_INET
+@functools.lru_cache(maxsize=4096)
+def _from_af_union(af, addr):
+    # The union is always 16 bytes, so only an IPv4 address needs trimming.
+    return _inet_ntop(af, addr if af == socket.AF_INET6 else addr[:4])
 
 
-def _to_af_union(ip):
-    af = _to_af(ip)
-    return af, socket.inet_pton(af, ip).ljust(16, b'\0')
+@functools.lru_cache(maxsize=64)
+def _pack_flags(flags):
+    # The mask is the flags themselves: only the flags we set are changed.
+    # There are just a couple of combinations, so the packed bytes are cached.
+    return _FLAGS_ST.pack(flags, flags)
 
 
-def _from_af_union(af, addr):
-    n = 4 if af == socket.AF_INET else 16
-    return socket.inet_ntop(af, addr[:n])
+_PROTO_FROM_NUM = {
+    None: None,
+    socket.IPPROTO_TCP: 'tcp',
+    socket.IPPROTO_UDP: 'udp',
+}
+
+# Every spelling of a protocol name in use maps straight to its number.
+_PROTO_TO_NUM = {None: None}
+for _num, _name in _PROTO_FROM_NUM.items():
+    if _name is not None:
+        for _proto in (_name, _name.upper(), _name.capitalize()):
+            _PROTO_TO_NUM[_proto] = _num
+del _num, _name, _proto
+
+# The kernel only knows a handful of schedulers, so every Service built from
+# a dump shares one string per scheduler name.
+_SCHED_INTERN = {}
 
 
 def _to_proto_num(proto):
-    if proto is None:
-        return None
-    if proto.lower() == 'tcp':
-        return socket.IPPROTO_TCP
-    elif proto.lower() == 'udp':
-        return socket.IPPROTO_UDP
-    else:
-        assert False, 'unknown proto %s' % proto
+    try:
+        return _PROTO_TO_NUM[proto]
+    except KeyError:
+        # Any other mixed case spelling.
+        num = _PROTO_TO_NUM.get(proto.lower())
+        assert num is not None, 'unknown proto %s' % proto
+        return num
 
 
 def _from_proto_num(n):
-    if n is None:
-        return None
-    if n == socket.IPPROTO_TCP:
-        return 'tcp'
-    elif n == socket.IPPROTO_UDP:
-        return 'udp'
-    else:
+    try:
+        return _PROTO_FROM_NUM[n]
+    except KeyError:
         assert False, 'unknown proto num %d' % n
 
 
 class Dest(object):
     """Describes a real server to be load balanced to."""
 
-    def __init__(self, d={}, validate=False):
-        self.ip_ = d.get('ip', None)
-        self.weight_ = d.get('weight', None)
-        self.port_ = d.get('port', None)
-        self.fwd_method_ = d.get('fwd_method', IPVS_TUNNELING)
-        self.counters_ = d.get('counters', {})
+    __slots__ = ('ip_', 'weight_', 'port_', 'fwd_method_', 'counters_')
+
+    def __init__(self, d=None, validate=False, ip=None, weight=None,
+                 port=None, fwd_method=IPVS_TUNNELING, counters=None):
+        if d is not None:
+            ip = d.get('ip', ip)
+            weight = d.get('weight', weight)
+            port = d.get('port', port)
+            fwd_method = d.get('fwd_method', fwd_method)
+            counters = d.get('counters', counters)
+        self.ip_ = ip
+        self.weight_ = weight
+        self.port_ = port
+        self.fwd_method_ = fwd_method
+        self.counters_ = counters if counters is not None else {}
 
     def __repr__(self):
         return 'Dest(d=dict(ip="%s", weight=%d))' % (self.ip(), self.weight())
@@ -245,41 +300,37 @@ class Dest(object):
 
     def to_attr_list(self):
         af, addr = _to_af_union(self.ip_)
-        return IpvsDestAttrList(addr_family=af,
-                                addr=addr,
-                                port=self.port_,
-                                fwd_method=self.fwd_method_)
+        return IpvsDestAttrList.from_tuple((
+            addr, self.port_, self.fwd_method_, None, None, None, None, None,
+            None, None, af))
 
     def __eq__(self, other):
-        return isinstance(other, Dest) and self.to_dict() == other.to_dict()
-
-    def __ne__(self, other):
-        return not self.__eq__(other)
+        return (isinstance(other, Dest) and
+                (self.ip_, self.weight_) == (other.ip_, other.weight_))
 
     @staticmethod
     def from_attr_list(lst, default_af=None):
+        stats = lst.get('stats')
         return Dest(
-            d={
-                'ip': _from_af_union(lst.get('addr_family', default_af),
-                                     lst.get('addr')),
-                'weight': lst.get('weight'),
-                'port': lst.get('port'),
-                'fwd_method': lst.get('fwd_method'),
-                'counters': {
-                    'active_conns':   lst.get('active_conns'),
-                    'inact_conns':    lst.get('inact_conns'),
-                    'persist_conns':  lst.get('persist_conns'),
-                    'conns':          lst.get('stats').get('conns'),
-                    'inpkts':         lst.get('stats').get('inpkts'),
-                    'outpkts':        lst.get('stats').get('outpkts'),
-                    'inbytes':        lst.get('stats').get('inbytes'),
-                    'outbytes':       lst.get('stats').get('outbytes'),
-                    'cps':            lst.get('stats').get('cps'),
-                    'inpps':          lst.get('stats').get('inpps'),
-                    'outpps':         lst.get('stats').get('outpps'),
-                    'inbps':          lst.get('stats').get('inbps'),
-                    'outbps':         lst.get('stats').get('outbps')
-                }
+            ip=_from_af_union(lst.get('addr_family', default_af),
+                              lst.get('addr')),
+            weight=lst.get('weight'),
+            port=lst.get('port'),
+            fwd_method=lst.get('fwd_method'),
+            counters={
+                'active_conns':   lst.get('active_conns'),
+                'inact_conns':    lst.get('inact_conns'),
+                'persist_conns':  lst.get('persist_conns'),
+                'conns':          stats.get('conns'),
+                'inpkts':         stats.get('inpkts'),
+                'outpkts':        stats.get('outpkts'),
+                'inbytes':        stats.get('inbytes'),
+                'outbytes':       stats.get('outbytes'),
+                'cps':            stats.get('cps'),
+                'inpps':          stats.get('inpps'),
+                'outpps':         stats.get('outpps'),
+                'inbps':          stats.get('inbps'),
+                'outbps':         stats.get('outbps')
             },
             validate=True,
         )
@@ -289,17 +340,28 @@ class Service(object):
     """Describes a load balanced service.
     """
 
-    def __init__(self, d={}, validate=False):
-        self.proto_ = d.get('proto', None)
-        self.vip_ = d.get('vip', None)
-        self.port_ = d.get('port', None)
-        self.sched_ = d.get('sched', None)
-        self.fwmark_ = d.get('fwmark', None)
-        default_af = None
-        if self.vip_:
-            default_af = _to_af(self.vip_)
-        self.af_ = d.get('af', default_af)
-        self.counters_ = d.get('counters', {})
+    __slots__ = ('proto_', 'vip_', 'port_', 'sched_', 'fwmark_', 'af_',
+                 'counters_')
+
+    def __init__(self, d=None, validate=False, proto=None, vip=None,
+                 port=None, sched=None, fwmark=None, af=None, counters=None):
+        if d is not None:
+            proto = d.get('proto', proto)
+            vip = d.get('vip', vip)
+            port = d.get('port', port)
+            sched = d.get('sched', sched)
+            fwmark = d.get('fwmark', fwmark)
+            af = d.get('af', af)
+            counters = d.get('counters', counters)
+        if af is None and vip:
+            af = _to_af(vip)
+        self.proto_ = proto
+        self.vip_ = vip
+        self.port_ = port
+        self.sched_ = sched
+        self.fwmark_ = fwmark
+        self.af_ = af
+        self.counters_ = counters if counters is not None else {}
         if validate:
             self.validate()
 
@@ -349,8 +411,11 @@ class Service(object):
             assert self.vip_ is None
             assert self.fwmark_ > 0 and self.fwmark_ < (2 ** 32)
 
+    def __key(self):
+        return (self.proto_, self.vip_, self.port_, self.sched_, self.fwmark_,
+                self.af_)
+
     def to_dict(self):
-        self.validate()
         if self.fwmark_ is None:
             return {
                 'proto': self.proto_,
@@ -371,59 +436,62 @@ class Service(object):
             af, addr = _to_af_union(self.vip_)
             netmask = ((1 << 32) - 1) if af == socket.AF_INET else 128
             proto = self.proto_num()
-            return IpvsServiceAttrList(af=af, addr=addr, protocol=proto,
-                                       netmask=netmask, port=self.port_,
-                                       sched_name=self.sched_,
-                                       flags=struct.pack(str('=II'), 0, 0))
+            return IpvsServiceAttrList.from_tuple((
+                af, proto, addr, self.port_, None, self.sched_,
+                _ZERO_FLAGS, None, netmask))
         else:
             netmask = ((1 << 32) - 1)
-            return IpvsServiceAttrList(fwmark=self.fwmark_, af=self.af_,
-                                       netmask=netmask, sched_name=self.sched_,
-                                       flags=struct.pack(str('=II'), 0, 0))
+            return IpvsServiceAttrList.from_tuple((
+                self.af_, None, None, None, self.fwmark_, self.sched_,
+                _ZERO_FLAGS, None, netmask))
 
     def __eq__(self, other):
-        return isinstance(other, Service) and self.to_dict() == other.to_dict()
-
-    def __ne__(self, other):
-        return not self.__eq__(other)
+        return isinstance(other, Service) and self.__key() == other.__key()
 
     @staticmethod
     def from_attr_list(lst):
+        sched = lst.get('sched_name')
+        sched = _SCHED_INTERN.setdefault(sched, sched)
         if lst.get('addr', None) is not None:
-            d = dict(
+            stats = lst.get('stats')
+            return Service(
                 vip=_from_af_union(lst.get('af'), lst.get('addr')),
                 proto=_from_proto_num(lst.get('protocol')),
                 port=lst.get('port'),
-                sched=lst.get('sched_name'),
+                sched=sched,
                 af=lst.get('af'),
                 counters={
-                    'conns':     lst.get('stats').get('conns'),
-                    'inpkts':    lst.get('stats').get('inpkts'),
-                    'outpkts':   lst.get('stats').get('outpkts'),
-                    'inbytes':   lst.get('stats').get('inbytes'),
-                    'outbytes':  lst.get('stats').get('outbytes'),
-                    'cps':       lst.get('stats').get('cps'),
-                    'inpps':     lst.get('stats').get('inpps'),
-                    'outpps':    lst.get('stats').get('outpps'),
-                    'inbps':     lst.get('stats').get('inbps'),
-                    'outbps':    lst.get('stats').get('outbps')
-                }
+                    'conns':     stats.get('conns'),
+                    'inpkts':    stats.get('inpkts'),
+                    'outpkts':   stats.get('outpkts'),
+                    'inbytes':   stats.get('inbytes'),
+                    'outbytes':  stats.get('outbytes'),
+                    'cps':       stats.get('cps'),
+                    'inpps':     stats.get('inpps'),
+                    'outpps':    stats.get('outpps'),
+                    'inbps':     stats.get('inbps'),
+                    'outbps':    stats.get('outbps')
+                },
+                validate=True,
             )
-        else:
-            d = dict(
-                fwmark=lst.get('fwmark'),
-                sched=lst.get('sched_name'),
-                af=lst.get('af'),
-            )
-        return Service(d=d, validate=True)
+        return Service(
+            fwmark=lst.get('fwmark'),
+            sched=sched,
+            af=lst.get('af'),
+            validate=True,
+        )
 
 
 class Pool(object):
     """A tuple of a service and an array of dests for that service
     """
 
-    def __init__(self, d={}, validate=False):
-        self.service_ = Service(d.get('service', {}), validate)
+    __slots__ = ('service_', 'dests_')
+
+    def __init__(self, d=None, validate=False):
+        if d is None:
+            d = {}
+        self.service_ = Service(d.get('service'), validate)
         self.dests_ = [Dest(x, validate) for x in d.get('dests', [])]
 
     def service(self):
@@ -438,7 +506,6 @@ class Pool(object):
             dest.validate()
 
     def to_dict(self):
-        self.validate()
         return {
             'service': self.service_.to_dict(),
             'dests': [d.to_dict() for d in self.dests_],
@@ -448,7 +515,9 @@ class Pool(object):
     def from_args(service=None, dests=[]):
         assert isinstance(service, Service)
         assert isinstance(dests, list)
-        p = Pool()
+        # Skip __init__, which would build an empty Service just for it to be
+        # replaced.
+        p = Pool.__new__(Pool)
         p.service_ = service
         p.dests_ = dests
         return p
@@ -458,15 +527,74 @@ class Pool(object):
         return [Pool(i, True) for i in lst]
 
 
+def _dests_from_msgs(msgs, af):
+    # All the dests of a service share its address family, and their
+    # addresses go through the memoized _from_af_union, so every distinct
+    # RIP is only decoded once per process.
+    from_attr_list = Dest.from_attr_list
+    return [from_attr_list(m.get_attr_list().get('dest'), af) for m in msgs]
+
+
 class IpvsClient(object):
     """A python client to use instead of shelling out to ipvsadm
     """
 
+    # Requests without arguments never change, so they are built only once.
+    # Sending a message does not modify it.
+    _FLUSH_MSG = IpvsMessage('flush', flags=netlink.MessageFlags.ACK_REQUEST)
+    _GET_SVC_MSG = IpvsMessage(
+        'get_service', flags=netlink.MessageFlags.MATCH_ROOT_REQUEST)
+
     def __init__(self, verbose=False):
         self.verbose = verbose
         self.nlsock = netlink.NetlinkSocket(verbose=verbose)
+        # Holds the requests queued by the current thread's batch(), if any.
+        self._batch = threading.local()
+        if not verbose:
+            # Bind the undecorated methods so that bulk mutations don't pay
+            # for the verbose wrapper's extra frame on every call.  Only
+            # methods wrapped by @verbose are replaced.
+            cls = type(self)
+            for name in dir(cls):
+                f = getattr(getattr(cls, name), '_quiet', None)
+                if f is not None:
+                    setattr(self, name, types.MethodType(f, self))
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Queue up the add/update/del calls made inside the block, and send
+        them all when it ends, several requests per write to the socket:
+
+            with client.batch():
+                client.add_service('1.1.1.1', 80)
+                client.add_dest('1.1.1.1', 80, '2.2.2.1')
+
+        Nothing is sent if the block raises.  If a request fails, the others
+        are still applied and the first error is raised at the end.  A
+        nested batch is queued in order with the enclosing one.  Only the
+        calls made by the thread which opened the batch are queued.
+        """
+        outer = getattr(self._batch, 'requests', None)
+        requests = []
+        self._batch.requests = requests
+        try:
+            yield self
+        finally:
+            self._batch.requests = outer
+        if outer is None:
+            self.nlsock.execute_many(requests)
+        else:
+            outer.extend(requests)
 
-    def __modify_service(self, method, vip, port, protocol, ops, **svc_kwargs):
+    def _execute(self, request):
+        requests = getattr(self._batch, 'requests', None)
+        if requests is None:
+            self.nlsock.execute(request)
+        else:
+            requests.append(request)
+
+    def __modify_service(self, method, vip, port, protocol, ops,
+                         sched_name=None, timeout=None):
         if ops:
             assert protocol == socket.IPPROTO_UDP
 
@@ -479,19 +607,13 @@ class IpvsClient(object):
 
         out_msg = IpvsMessage(
             method, flags=netlink.MessageFlags.ACK_REQUEST,
-            attr_list=IpvsCmdAttrList(
-                service=IpvsServiceAttrList(
-                    af=af,
-                    port=port,
-                    protocol=protocol,
-                    addr=addr,
-                    netmask=netmask,
-                    flags=struct.pack(str('=II'), flags, flags),
-                    **svc_kwargs
-                )
-            )
+            attr_list=IpvsCmdAttrList.from_tuple((
+                IpvsServiceAttrList.from_tuple((
+                    af, protocol, addr, port, None, sched_name,
+                    _pack_flags(flags), timeout, netmask)),
+            ))
         )
-        self.nlsock.execute(out_msg)
+        self._execute(out_msg)
 
     @verbose
     def add_service(self, vip, port, protocol=socket.IPPROTO_TCP,
@@ -503,21 +625,18 @@ class IpvsClient(object):
     def del_service(self, vip, port, protocol=socket.IPPROTO_TCP):
         self.__modify_service('del_service', vip, port, protocol, False)
 
-    def __modify_fwm_service(self, method, fwmark, af, **svc_kwargs):
+    def __modify_fwm_service(self, method, fwmark, af, sched_name=None,
+                             timeout=None):
         netmask = ((1 << 32) - 1) if af == socket.AF_INET else 128
         out_msg = IpvsMessage(
             method, flags=netlink.MessageFlags.ACK_REQUEST,
-            attr_list=IpvsCmdAttrList(
-                service=IpvsServiceAttrList(
-                    fwmark=fwmark,
-                    flags=struct.pack(str('=II'), 0, 0),
-                    af=af,
-                    netmask=netmask,
-                    **svc_kwargs
-                )
-            )
+            attr_list=IpvsCmdAttrList.from_tuple((
+                IpvsServiceAttrList.from_tuple((
+                    af, None, None, None, fwmark, sched_name, _ZERO_FLAGS,
+                    timeout, netmask)),
+            ))
         )
-        self.nlsock.execute(out_msg)
+        self._execute(out_msg)
 
     @verbose
     def add_fwm_service(self, fwmark, sched_name='rr', af=socket.AF_INET):
@@ -529,28 +648,22 @@ class IpvsClient(object):
         self.__modify_fwm_service('del_service', fwmark, af=af)
 
     def __modify_dest(self, method, vip, port, rip, rport=None,
-                      protocol=socket.IPPROTO_TCP, **dest_kwargs):
+                      protocol=socket.IPPROTO_TCP, fwd_method=None,
+                      weight=None, u_thresh=None, l_thresh=None):
         vaf, vaddr = _to_af_union(vip)
         raf, raddr = _to_af_union(rip)
         rport = rport or port
         out_msg = IpvsMessage(
             method, flags=netlink.MessageFlags.ACK_REQUEST,
-            attr_list=IpvsCmdAttrList(
-                service=IpvsServiceAttrList(
-                    af=vaf,
-                    port=port,
-                    protocol=protocol,
-                    addr=vaddr,
-                ),
-                dest=IpvsDestAttrList(
-                    addr_family=raf,
-                    addr=raddr,
-                    port=rport,
-                    **dest_kwargs
-                ),
-            ),
+            attr_list=IpvsCmdAttrList.from_tuple((
+                IpvsServiceAttrList.from_tuple((
+                    vaf, protocol, vaddr, port)),
+                IpvsDestAttrList.from_tuple((
+                    raddr, rport, fwd_method, weight, u_thresh, l_thresh,
+                    None, None, None, None, raf)),
+            )),
         )
-        self.nlsock.execute(out_msg)
+        self._execute(out_msg)
 
     @verbose
     def add_dest(self, vip, port, rip, rport=None,
@@ -559,6 +672,28 @@ class IpvsClient(object):
                            protocol=protocol, weight=weight,
                            fwd_method=method, l_thresh=0, u_thresh=0)
 
+    @verbose
+    def bulk_add_dests(self, vip, port, dests, protocol=socket.IPPROTO_TCP):
+        """Add each Dest in dests to a service, as add_dest() would.
+
+        The service attribute list is only built once for all of them.  A
+        Dest without a weight gets a weight of 1, as with add_dest().
+        """
+        vaf, vaddr = _to_af_union(vip)
+        svc_lst = IpvsServiceAttrList.from_tuple((vaf, protocol, vaddr, port))
+        for dest in dests:
+            raf, raddr = _to_af_union(dest.ip())
+            self._execute(IpvsMessage(
+                'new_dest', flags=netlink.MessageFlags.ACK_REQUEST,
+                attr_list=IpvsCmdAttrList.from_tuple((
+                    svc_lst,
+                    IpvsDestAttrList.from_tuple((
+                        raddr, dest.port() or port, dest.fwd_method(),
+                        1 if dest.weight() is None else dest.weight(),
+                        0, 0, None, None, None, None, raf)),
+                )),
+            ))
+
     @verbose
     def update_dest(self, vip, port, rip, rport=None,
                     protocol=socket.IPPROTO_TCP, weight=None,
@@ -573,24 +708,20 @@ class IpvsClient(object):
         self.__modify_dest('del_dest', vip, port, rip, rport, protocol)
 
     def __modify_fwm_dest(self, method, fwmark, rip, vaf, port,
-                          **dest_kwargs):
+                          fwd_method=None, weight=None, u_thresh=None,
+                          l_thresh=None):
         raf, raddr = _to_af_union(rip)
         out_msg = IpvsMessage(
             method, flags=netlink.MessageFlags.ACK_REQUEST,
-            attr_list=IpvsCmdAttrList(
-                service=IpvsServiceAttrList(
-                    fwmark=fwmark,
-                    af=vaf,
-                ),
-                dest=IpvsDestAttrList(
-                    addr_family=raf,
-                    addr=raddr,
-                    port=port,
-                    **dest_kwargs
-                ),
-            ),
+            attr_list=IpvsCmdAttrList.from_tuple((
+                IpvsServiceAttrList.from_tuple((
+                    vaf, None, None, None, fwmark)),
+                IpvsDestAttrList.from_tuple((
+                    raddr, port, fwd_method, weight, u_thresh, l_thresh,
+                    None, None, None, None, raf)),
+            )),
         )
-        self.nlsock.execute(out_msg)
+        self._execute(out_msg)
 
     @verbose
     def add_fwm_dest(self, fwmark, rip, vaf=socket.AF_INET, port=0, weight=1):
@@ -610,8 +741,7 @@ class IpvsClient(object):
         self.__modify_fwm_dest('del_dest', fwmark, rip, vaf=vaf, port=port)
 
     def flush(self):
-        out_msg = IpvsMessage('flush', flags=netlink.MessageFlags.ACK_REQUEST)
-        self.nlsock.execute(out_msg)
+        self._execute(self._FLUSH_MSG)
 
     def get_pools(self):
         """
@@ -619,24 +749,44 @@ class IpvsClient(object):
         """
         pools = []
 
-        req = IpvsMessage(
-            'get_service', flags=netlink.MessageFlags.MATCH_ROOT_REQUEST)
-        for msg in self.nlsock.query(req):
-            svc_lst = msg.get_attr_list().get('service')
-            service = Service.from_attr_list(svc_lst)
-            dests = self.get_dests(svc_lst)
+        svc_lsts = [msg.get_attr_list().get('service')
+                    for msg in self.nlsock.query(self._GET_SVC_MSG)]
+        # query_many sends each request before pulling the next one, so a
+        # single message can be reused with each service swapped in.
+        dst_req = IpvsMessage(
+            'get_dest', flags=netlink.MessageFlags.MATCH_ROOT_REQUEST)
+
+        def dst_reqs():
+            for svc_lst in svc_lsts:
+                dst_req.get_attr_list().set('service', svc_lst)
+                yield dst_req
+
+        replies = self.nlsock.query_many(dst_reqs())
+        for svc_lst, dst_msgs in zip(svc_lsts, replies):
+            # dst_msgs is None if the service went away after the dump
+            dests = _dests_from_msgs(dst_msgs or [], svc_lst.get('af'))
             pools.append(Pool.from_args(
-                service=service,
+                service=Service.from_attr_list(svc_lst),
                 dests=dests
             ))
 
         return pools
 
     def get_pool(self, svc_lst):
-        s = self.get_service(svc_lst)
-        if s is None:
+        # Both lookups only need svc_lst, so exchange them in one batch.
+        svc_msgs, dst_msgs = self.nlsock.query_many([
+            IpvsMessage(
+                'get_service', flags=netlink.MessageFlags.REQUEST,
+                attr_list=IpvsCmdAttrList(service=svc_lst)),
+            IpvsMessage(
+                'get_dest', flags=netlink.MessageFlags.MATCH_ROOT_REQUEST,
+                attr_list=IpvsCmdAttrList(service=svc_lst)),
+        ])
+        if svc_msgs is None:
+            # The service is not present
             return None
-        dests = self.get_dests(s.to_attr_list())
+        s = Service.from_attr_list(svc_msgs[0].get_attr_list().get('service'))
+        dests = _dests_from_msgs(dst_msgs or [], s.af())
         return Pool.from_args(service=s, dests=dests)
 
     def get_service(self, svc_lst):
@@ -654,16 +804,13 @@ class IpvsClient(object):
 
     def get_dests(self, svc_lst):
         assert isinstance(svc_lst, IpvsServiceAttrList)
-        dests = []
         out_msg = IpvsMessage(
             'get_dest', flags=netlink.MessageFlags.MATCH_ROOT_REQUEST,
             attr_list=IpvsCmdAttrList(service=svc_lst)
         )
         try:
-            for dst_msg in self.nlsock.query(out_msg):
-                dst_lst = dst_msg.get_attr_list().get('dest')
-                dests.append(Dest.from_attr_list(dst_lst, svc_lst.get('af')))
-            return dests
+            dst_msgs = self.nlsock.query(out_msg)
         except RuntimeError:
             # Typically happens if the service is not defined
             return None
+        return _dests_from_msgs(dst_msgs, svc_lst.get('af'))
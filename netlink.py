@@ -87,16 +87,9 @@ socket.
     reply.get_attr_list().get('some_short')  # is a short!
 """
 
-from __future__ import absolute_import
-from __future__ import division
-from __future__ import print_function
-from __future__ import unicode_literals
-
-import array
 import errno
 import logging
 import os
-import six
 import socket
 import struct
 import subprocess
@@ -133,15 +126,28 @@ class MessageFlags(object):
     MATCH_ROOT_REQUEST = (MATCH | ROOT | REQUEST)
 
 
+# Precompiled headers: the attribute header, the genetlink header and the
+# netlink message header.  These are packed and unpacked for every attribute
+# and message, so the formats are only parsed once.
+_HH = struct.Struct('=HH')
+_BBxx = struct.Struct('=BBxx')
+_HDR = struct.Struct('=IHHII')
+_I32 = struct.Struct('=i')
+# Room for an attribute header, which is then written with pack_into
+_NO_HDR = b'\0' * _HH.size
+# Attributes are padded to a multiple of 4 bytes with a slice of this
+_PAD = b'\0\0\0'
+
+
 def create_struct_fmt_type(fmt):
+    st = struct.Struct(fmt)
+
     class StructFmtType:
-        @staticmethod
-        def pack(val):
-            return array.array(str('B'), struct.pack(str(fmt), val))
+        pack = staticmethod(st.pack)
 
         @staticmethod
         def unpack(data):
-            return struct.unpack(str(fmt), data)[0]
+            return st.unpack(data)[0]
 
     return StructFmtType
 
@@ -168,7 +174,7 @@ class IgnoreType(object):
 class BinaryType(object):
     @staticmethod
     def pack(val):
-        assert isinstance(val, six.binary_type)
+        assert isinstance(val, bytes)
         return val
 
     @staticmethod
@@ -183,18 +189,43 @@ class NulStringType(object):
     '''
     @staticmethod
     def pack(val):
-        return six.b(val) + b'\0'
+        if isinstance(val, str):
+            val = val.encode('utf-8')
+        return val + b'\0'
 
     @staticmethod
     def unpack(val):
-        assert six.indexbytes(val, -1) == 0
-        return val[:-1].decode()
+        assert val[-1:] == b'\0'
+        return val[:-1].decode('utf-8')
 
 
 class AttrListPacker(object):
     pass
 
 
+def _attr_property(key):
+    def fget(self):
+        return self.attrs.get(key)
+
+    def fset(self, value):
+        self.attrs[key] = value
+
+    return property(fget, fset)
+
+
+def _cmd_factory(cmd):
+    def factory(cls, *args, **kwargs):
+        return cls(cmd, *args, **kwargs)
+
+    return classmethod(factory)
+
+
+# Types already built by create_attr_list_type and create_genl_message_type,
+# so that asking for the same definition again hands back the same class.
+_attr_list_types = {}
+_genl_message_types = {}
+
+
 def create_attr_list_type(class_name, *fields):
     """Create a new attr_list_type which is a class offering get and set
     methods which is capable of serializing and deserializing itself from
@@ -204,51 +235,95 @@ def create_attr_list_type(class_name, *fields):
     attr_list_types can be used as packers in other attr_list_types.  The
     names and packers of the field should be taken from the appropriate
     linux kernel header and source files.
+
+    Creating the same type twice returns the class created the first time.
     """
+    # Fields may also be given as lists, which can't be hashed.
+    definition = (class_name, tuple(tuple(f) for f in fields))
+    if definition in _attr_list_types:
+        return _attr_list_types[definition]
+
     name_to_key = {}
     key_to_name = {}
     key_to_packer = {}
     for i, (name, packer) in enumerate(fields):
         key = i + 1
         name_to_key[name.upper()] = key
+        # Callers mostly spell names in lowercase; mapping that directly
+        # saves them an upper() on each get() and set().
+        name_to_key[name.lower()] = key
         key_to_name[key] = name
         key_to_packer[key] = packer
+    # Nested lists are unpacked straight from a view of the parent's data;
+    # every other packer gets its own bytes.
+    nested_keys = frozenset(
+        k for k, packer in key_to_packer.items()
+        if packer is RecursiveSelf or (
+            isinstance(packer, type) and issubclass(packer, AttrListPacker)))
+    # The pack and unpack functions for each key, with RecursiveSelf already
+    # resolved.  These are filled in once AttrListType exists, below.
+    key_to_pack = {}
+    key_to_unpack = {}
 
     class AttrListType(AttrListPacker):
         def __init__(self, **kwargs):
             self.attrs = {}
-            for k, v in six.iteritems(kwargs):
+            for k, v in kwargs.items():
                 if v is not None:
                     self.set(k, v)
 
         def set(self, key, value):
             if not isinstance(key, int):
-                key = name_to_key[key.upper()]
+                try:
+                    key = name_to_key[key]
+                except KeyError:
+                    key = name_to_key[key.upper()]
             self.attrs[key] = value
 
         def get(self, key, default=_unset):
             try:
                 if not isinstance(key, int):
-                    key = name_to_key[key.upper()]
+                    try:
+                        key = name_to_key[key]
+                    except KeyError:
+                        key = name_to_key[key.upper()]
                 return self.attrs[key]
             except KeyError:
                 if default is not _unset:
                     return default
                 raise
 
+        @staticmethod
+        def field(name):
+            """Return the key of the named field and its pack function."""
+            try:
+                key = name_to_key[name]
+            except KeyError:
+                key = name_to_key[name.upper()]
+            return key, key_to_pack[key]
+
+        @staticmethod
+        def from_tuple(values):
+            # Fast path for callers building lots of attr lists: the values
+            # are given in field order, with None for the unset ones, so
+            # there are no keyword arguments or names to look up and
+            # __init__ can be skipped altogether.
+            attr_list = AttrListType.__new__(AttrListType)
+            attr_list.attrs = {k: v for k, v in enumerate(values, 1)
+                               if v is not None}
+            return attr_list
+
         def __repr__(self):
             attrs = ['%s=%s' % (key_to_name[k].lower(), repr(v))
-                     for k, v in six.iteritems(self.attrs)]
+                     for k, v in self.attrs.items()]
             return '%s(%s)' % (class_name, ', '.join(attrs))
 
         @staticmethod
         def pack(attr_list):
-            packed = array.array(str('B'))
-            for k, v in six.iteritems(attr_list.attrs):
-                if key_to_packer[k] == RecursiveSelf:
-                    x = AttrListType.pack(v)
-                else:
-                    x = key_to_packer[k].pack(v)
+            packed = bytearray()
+            pack_hh_into = _HH.pack_into
+            for k, v in attr_list.attrs.items():
+                x = key_to_pack[k](v)
                 alen = len(x) + 4
 
                 # TODO(agartrell): This is scary.  In theory, we should OR
@@ -256,26 +331,56 @@ def create_attr_list_type(class_name, *fields):
                 # AttrListPacker, but this didn't work for some reason, so
                 # we're not going to.
 
-                packed.fromstring(struct.pack(str('=HH'), alen, k))
-                packed.fromstring(x)
-                packed.fromstring('\0' * ((4 - (len(x) % 4)) & 0x3))
+                off = len(packed)
+                packed += _NO_HDR
+                packed += x
+                pad = -len(x) & 3
+                if pad:
+                    packed += _PAD[:pad]
+                pack_hh_into(packed, off, alen, k)
             return packed
 
         @staticmethod
         def unpack(data):
-            global global_nest
-            attr_list = AttrListType()
-            while len(data) > 0:
-                alen, k = struct.unpack(str('=HH'), data[:4])
+            # Keys read off the wire are already ints, so fill the dict
+            # directly instead of going through __init__() and set().
+            attr_list = AttrListType.__new__(AttrListType)
+            attrs = attr_list.attrs = {}
+            unpack_hh = _HH.unpack_from
+            # Walk the attributes with an offset into a view of the data
+            # rather than slicing off a copy of the remainder each time.
+            data = memoryview(data)
+            off = 0
+            end = len(data)
+            while off < end:
+                alen, k = unpack_hh(data, off)
                 alen = alen & 0x7fff
-                if key_to_packer[k] == RecursiveSelf:
-                    v = AttrListType.unpack(data[4:alen])
+                if k in nested_keys:
+                    v = key_to_unpack[k](data[off + 4:off + alen])
                 else:
-                    v = key_to_packer[k].unpack(data[4:alen])
-                attr_list.set(k, v)
-                data = data[((alen + 3) & (~3)):]
+                    v = key_to_unpack[k](data[off + 4:off + alen].tobytes())
+                attrs[k] = v
+                off += (alen + 3) & (~3)
             return attr_list
 
+    for key, packer in key_to_packer.items():
+        if packer is RecursiveSelf:
+            packer = AttrListType
+        # Some packers only go one way (IgnoreType has no pack, for one).
+        if hasattr(packer, 'pack'):
+            key_to_pack[key] = packer.pack
+        if hasattr(packer, 'unpack'):
+            key_to_unpack[key] = packer.unpack
+
+    # Each field can also be read and written as a plain attribute, e.g.
+    # attr_list.family_name, which skips the name lookup altogether.  Unset
+    # fields read as None.  Names already taken by the class, or by the
+    # instances' attrs dict, are left to get() and set().
+    for key, name in key_to_name.items():
+        if name.lower() != 'attrs' and not hasattr(AttrListType, name.lower()):
+            setattr(AttrListType, name.lower(), _attr_property(key))
+
+    _attr_list_types[definition] = AttrListType
     return AttrListType
 
 
@@ -292,8 +397,14 @@ def create_genl_message_type(class_name, family_id_or_name, *fields,
 
     This method further registers the new message type using the
     @message_class decorator, which allows us to serialize and deserialize
-    it from any appropriate netlink socket instance.
+    it from any appropriate netlink socket instance.  Creating the same
+    message type twice returns the class created the first time; creating a
+    different one for a family which is already defined asserts.
     """
+    definition = (class_name, tuple(tuple(f) for f in fields),
+                  tuple(kwargs.get('required_modules', [])))
+    if _genl_message_types.get(family_id_or_name, (None,))[0] == definition:
+        return _genl_message_types[family_id_or_name][1]
 
     name_to_key = {}
     key_to_name = {}
@@ -301,6 +412,7 @@ def create_genl_message_type(class_name, family_id_or_name, *fields,
     for i, (name, attr_list_type) in enumerate(fields):
         key = i + 1
         name_to_key[name.upper()] = key
+        name_to_key[name.lower()] = key
         key_to_name[key] = name
         key_to_attr_list_type[key] = attr_list_type
 
@@ -312,7 +424,10 @@ def create_genl_message_type(class_name, family_id_or_name, *fields,
         def __init__(self, cmd, attr_list=_unset, version=0x1,
                      flags=MessageFlags.ACK_REQUEST):
             if not isinstance(cmd, int):
-                self.cmd = name_to_key[cmd.upper()]
+                try:
+                    self.cmd = name_to_key[cmd]
+                except KeyError:
+                    self.cmd = name_to_key[cmd.upper()]
             else:
                 self.cmd = cmd
 
@@ -335,17 +450,24 @@ def create_genl_message_type(class_name, family_id_or_name, *fields,
 
         @staticmethod
         def unpack(data):
-            cmd, version = struct.unpack(str('=BBxx'), data[:4])
-            attr_list = key_to_attr_list_type[cmd].unpack(data[4:])
+            cmd, version = _BBxx.unpack_from(data)
+            attr_list = key_to_attr_list_type[cmd].unpack(
+                memoryview(data)[4:])
             return MessageType(cmd, attr_list)
 
         @staticmethod
         def pack(msg):
-            s = array.array(
-                str('B'), struct.pack(str('=BBxx'), msg.cmd, msg.version))
-            s.extend(key_to_attr_list_type[msg.cmd].pack(msg.attr_list))
+            s = bytearray(_BBxx.pack(msg.cmd, msg.version))
+            s += key_to_attr_list_type[msg.cmd].pack(msg.attr_list)
             return s
 
+    # One constructor per command, e.g. Msg.GET(attr_list=...), with the
+    # command key already resolved.
+    for key, name in key_to_name.items():
+        if not hasattr(MessageType, name.upper()):
+            setattr(MessageType, name.upper(), _cmd_factory(key))
+
+    _genl_message_types[family_id_or_name] = (definition, MessageType)
     return MessageType
 
 
@@ -355,6 +477,22 @@ def create_genl_message_type(class_name, family_id_or_name, *fields,
 __cmd_unpack_map = {
 }
 __to_lookup_on_init = set()
+# The same map as a list indexed by family ID, which is quicker to look up
+# for every received message.  Family IDs are small, but the list only covers
+# the first few so that an odd large ID can't make it huge; the rest are
+# looked up in the map.
+__cmd_unpack_list = []
+_MAX_LISTED_FAMILY = 1024
+
+
+def _register_message_class(msg_class):
+    family = msg_class.family
+    __cmd_unpack_map[family] = msg_class
+    if family < _MAX_LISTED_FAMILY:
+        if family >= len(__cmd_unpack_list):
+            __cmd_unpack_list.extend(
+                [None] * (family + 1 - len(__cmd_unpack_list)))
+        __cmd_unpack_list[family] = msg_class
 
 
 def message_class(msg_class):
@@ -366,7 +504,7 @@ def message_class(msg_class):
     if not isinstance(msg_class.family, int):
         __to_lookup_on_init.add(msg_class)
     else:
-        __cmd_unpack_map[msg_class.family] = msg_class
+        _register_message_class(msg_class)
 
     return msg_class
 
@@ -375,32 +513,104 @@ def setup_message_classes(nlsock):
     for msg_class in __to_lookup_on_init:
         if not isinstance(msg_class.family, int):
             msg_class.family = nlsock.resolve_family(msg_class.family)
-            __cmd_unpack_map[msg_class.family] = msg_class
+            _register_message_class(msg_class)
     __to_lookup_on_init.clear()
-    for family_id, msg_class in six.iteritems(__cmd_unpack_map):
+    for family_id, msg_class in __cmd_unpack_map.items():
         for mod in getattr(msg_class, 'required_modules', []):
             subprocess.check_call(['modprobe', mod])
 
 
-def deserialize_message(data):
-    (n, typ, flags, seq, pid) = struct.unpack(str('=IHHII'), data[:16])
-    if typ not in __cmd_unpack_map:
+def deserialize_message_from(data, off=0):
+    """Unpack the message found at offset off of data, and return it along
+    with the offset of the message that follows it.
+    """
+    (n, typ, flags, seq, pid) = _HDR.unpack_from(data, off)
+    if typ < len(__cmd_unpack_list):
+        msg_class = __cmd_unpack_list[typ]
+    else:
+        msg_class = __cmd_unpack_map.get(typ)
+    if msg_class is None:
         raise Exception("Unregistered netlink type: %d" % typ)
-    msg = __cmd_unpack_map[typ].unpack(data[16:n])
+    msg = msg_class.unpack(data[off + 16:off + n])
     msg.flags = flags
-    return msg, data[n:]
+    return msg, off + n
+
+
+def deserialize_message(data):
+    msg, n = deserialize_message_from(data)
+    # data may be a view of NetlinkSocket's receive buffer, which gets reused;
+    # copy the remainder out of it.
+    return msg, bytes(data[n:])
 
 
 def serialize_message(msg, port_id, seq):
     family = msg.__class__.family
     flags = msg.flags
     s = msg.__class__.pack(msg)
-    t = struct.pack(str('=IHHII'), len(s) + 16, family, flags, seq, port_id)
-    p = array.array(str('B'), t)
-    p.extend(s)
+    n = len(s) + 16
+    p = bytearray(n)
+    _HDR.pack_into(p, 0, n, family, flags, seq, port_id)
+    p[16:] = s
     return p
 
 
+class MessageTemplate(object):
+    """A message which is packed only once, for requests that are sent over
+    and over with just a few attributes changing.  The changing attributes
+    must be top level ones with a fixed size, such as the U32Type pid of a
+    taskstats request; they are patched into a copy of the packed message for
+    each request:
+
+        tmpl = MessageTemplate(TaskstatsMessage(
+            'GET', attr_list=TaskstatsAttrList(pid=0)), 'pid')
+        sock.query(tmpl.message(pid=1234))
+
+    The attributes named must be set in msg, to lay out the packed message.
+    """
+
+    def __init__(self, msg, *names):
+        msg_class = msg.__class__
+        self.cmd = msg.cmd
+        self.version = msg.version
+        self.flags = msg.flags
+        self.body = bytes(msg_class.pack(msg))
+
+        # Messages from the template keep the class of msg, so that it is
+        # registered and resolved as usual, but come with the body already
+        # packed.
+        class PackedMessageType(msg_class):
+            @staticmethod
+            def pack(m):
+                return m.body
+
+        self.msg_class = PackedMessageType
+
+        offsets = {}
+        off = _BBxx.size
+        while off < len(self.body):
+            alen, k = _HH.unpack_from(self.body, off)
+            offsets[k] = (off + 4, off + (alen & 0x7fff))
+            off += (alen + 3) & (~3)
+        self.fields = {}
+        for name in names:
+            key, pack = msg.get_attr_list().field(name)
+            start, end = offsets[key]
+            self.fields[name] = (start, end, pack)
+
+    def message(self, **values):
+        body = bytearray(self.body)
+        for name, value in values.items():
+            start, end, pack = self.fields[name]
+            x = pack(value)
+            assert len(x) == end - start, \
+                'Attribute %s changed size in a MessageTemplate' % name
+            body[start:end] = x
+        msg = self.msg_class(self.cmd, attr_list=None, version=self.version,
+                             flags=self.flags)
+        msg.body = body
+        return msg
+
+
 # In order to discover family IDs, we'll need to exchange some Ctrl
 # messages with the kernel.  We declare these message types and attribute
 # list types below.
@@ -466,7 +676,7 @@ class ErrorMessage(object):
 
     @staticmethod
     def unpack(data):
-        error = struct.unpack(str('=i'), data[:4])[0]
+        error = _I32.unpack(data[:4])[0]
         try:
             msg = deserialize_message(data[4:])
         except Exception:
@@ -491,6 +701,10 @@ class DoneMessage(object):
         return '\0\0\0\0'
 
 
+# The most requests NetlinkSocket.execute_many writes to the socket at once
+_EXECUTE_BATCH = 64
+
+
 class NetlinkSocket(object):
     def __init__(self, verbose=False):
         # NETLINK_GENERIC = 16
@@ -498,6 +712,11 @@ class NetlinkSocket(object):
         self.sock.bind((0, 0))
         self.port_id = self.sock.getsockname()[0]
         self.seq = 0
+        # A big buffer, reused across reads, to avoid truncating messages.
+        # The kernel sizes the skbs of a dump after the largest read it has
+        # seen on the socket, capped at 32k, so reading that much packs more
+        # replies into every recv and cuts the syscalls per dump.
+        self._recv_buf = bytearray(32768)
         self.lock = threading.Lock()
         self.verbose = verbose
         setup_message_classes(self)
@@ -518,17 +737,31 @@ class NetlinkSocket(object):
 
     def _recv(self):
         messages = []
+        # A dump can run to thousands of messages, so keep the lookups made
+        # for each one out of the loop.
+        append = messages.append
+        deserialize = deserialize_message_from
+        recv_into = self.sock.recv_into
         while True:
-            # A big buffer to avoid truncating message.
-            # The size is borrowed from libnetlink.
-            data = self.sock.recv(16384)
-            while len(data) > 0:
-                msg, data = deserialize_message(data)
-                if len(messages) == 0 and msg.flags & 0x2 == 0:
+            # MSG_TRUNC makes recv report the real length of the message even
+            # if it didn't fit in the buffer.
+            n = recv_into(self._recv_buf, 0, socket.MSG_TRUNC)
+            if n > len(self._recv_buf):
+                # The rest of the message is lost, but remember the size so
+                # the next one fits.
+                self._recv_buf = bytearray(max(n, 2 * len(self._recv_buf)))
+                raise RuntimeError('Truncated netlink message (%d bytes)' % n)
+            # Messages are unpacked from a view of the buffer: nothing in
+            # them refers back to it once they are built.
+            data = memoryview(self._recv_buf)
+            off = 0
+            while off < n:
+                msg, off = deserialize(data, off)
+                if not messages and msg.flags & 0x2 == 0:
                     return [msg]
                 elif isinstance(msg, DoneMessage):
                     return messages
-                messages.append(msg)
+                append(msg)
 
         return messages
 
@@ -549,6 +782,42 @@ class NetlinkSocket(object):
                     logging.error("Recv Messages: %s" % messages)
                 raise
 
+    def query_many(self, requests):
+        """Exchange each request in turn and return the replies to each one.
+
+        The lock is taken once for the whole batch.  The kernel only allows
+        one dump in progress per netlink socket, so the requests can't be
+        pipelined; they are sent back-to-back instead.  A request answered
+        with an error gets None rather than raising, so that one failure
+        doesn't throw away the rest of the batch.
+
+        `requests` can be any iterable.  Each request is serialized as it is
+        sent, before the next one is taken from the iterable.
+        """
+        with self.lock:
+            replies = []
+            for request in requests:
+                try:
+                    messages = None
+                    self._send(request)
+                    messages = self._recv()
+                except Exception as e:
+                    if self.verbose:
+                        logging.error("Netlink query failed: %s" % e)
+                        logging.error("Sent Request: %s" % request)
+                        logging.error("Recv Messages: %s" % messages)
+                    raise
+                for message in messages:
+                    if isinstance(message, ErrorMessage):
+                        if self.verbose:
+                            logging.error("Netlink query failed: %s" %
+                                          message)
+                            logging.error("Sent Request: %s" % request)
+                        messages = None
+                        break
+                replies.append(messages)
+            return replies
+
     def execute(self, request):
         with self.lock:
             try:
@@ -566,3 +835,37 @@ class NetlinkSocket(object):
                     logging.error("Sent Request: %s" % request)
                     logging.error("Recv Messages: %s" % messages)
                 raise
+
+    def execute_many(self, requests):
+        """Execute each request, as execute() would, writing several of them
+        to the socket at a time and then reading back all of their acks.
+
+        The kernel goes on with the rest of a write when one of its requests
+        fails, so every ack is read before the first error is raised.  The
+        requests are written in chunks of at most _EXECUTE_BATCH, so that
+        the acks waiting to be read can't overflow the socket's receive
+        buffer.
+        """
+        requests = list(requests)
+        with self.lock:
+            error = None
+            for i in range(0, len(requests), _EXECUTE_BATCH):
+                chunk = requests[i:i + _EXECUTE_BATCH]
+                buf = bytearray()
+                for request in chunk:
+                    buf += serialize_message(request, self.port_id, self.seq)
+                    self.seq += 1
+                self.sock.send(buf)
+                for request in chunk:
+                    messages = self._recv()
+                    assert len(messages) == 1
+                    assert isinstance(messages[0], ErrorMessage)
+                    if messages[0].error != 0 and error is None:
+                        eno = -messages[0].error
+                        error = OSError(eno, os.strerror(eno))
+                        if self.verbose:
+                            logging.error("Netlink execute failed: %s" %
+                                          error)
+                            logging.error("Sent Request: %s" % request)
+            if error is not None:
+                raise error
@@ -7,9 +7,6 @@
 # LICENSE file in the root directory of this source tree. An additional grant
 # of patent rights can be found in the PATENTS file in the same directory.
 
-# unicode literals breaks distutils.core.setup
-# @lint-avoid-python-3-compatibility-imports
-
 from setuptools import setup
 
 setup(
@@ -22,13 +19,11 @@ setup(
     license='BSD+',
     packages=['gnlpy'],
     package_dir={'gnlpy': '.'},
-    install_requires=['six'],
+    python_requires='>=3',
     classifiers=[
         'Intended Audience :: Developers',
         'License :: OSI Approved :: BSD License',
         'Operating System :: POSIX :: Linux',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
     ],
     keywords='generic netlink library',
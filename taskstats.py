@@ -10,16 +10,12 @@
 This module exists to expose the taskstats api to python
 """
 
-from __future__ import absolute_import
-from __future__ import division
-from __future__ import print_function
-
-# @lint-avoid-python-3-compatibility-imports
-# from __future__ import unicode_literals
-
 import struct
 import gnlpy.netlink as netlink
 
+# struct taskstats, version 8, field for field with Taskstats.__fields__
+_TS_ST = struct.Struct('HIBBQQQQQQQQ32sQxxxIIIIIQQQQQQQQQQQQQQQQQQQQQQQ')
+
 # These are attr_list_types which are nestable.  The command attribute list
 # is ultimately referenced by the messages which are passed down to the
 # kernel via netlink.  These structures must match the type and ordering
@@ -41,21 +37,26 @@ class Taskstats(object):
         'cpu_scaled_run_real_total', 'freepages_count',
         'freepages_delay_total'
     ]
+    __slots__ = tuple(__fields__)
 
     def __init__(self, **kwargs):
-        self.__dict__.update(kwargs)
+        for k, v in kwargs.items():
+            setattr(self, k, v)
 
     def __repr__(self):
-        arr = ['%s=%s' % (f, repr(self.__dict__[f])) for f in self.__fields__]
+        arr = ['%s=%s' % (f, repr(getattr(self, f))) for f in self.__fields__]
         return 'TaskStats(%s)' % ', '.join(arr)
 
     @staticmethod
     def unpack(val):
-        fmt = 'HIBBQQQQQQQQ32sQxxxIIIIIQQQQQQQQQQQQQQQQQQQQQQQ'
-        attrs = dict(zip(Taskstats.__fields__, struct.unpack(fmt, val)))
-        assert attrs['version'] == 8, "Bad version: %d" % attrs["version"]
-        attrs['comm'] = attrs['comm'].rstrip('\0')
-        return Taskstats(**attrs)
+        # Fill the slots straight from the unpacked tuple, without building
+        # a dict of keyword arguments first.
+        t = Taskstats.__new__(Taskstats)
+        for f, v in zip(Taskstats.__fields__, _TS_ST.unpack_from(val)):
+            setattr(t, f, v)
+        assert t.version == 8, "Bad version: %d" % t.version
+        t.comm = t.comm.rstrip(b'\0')
+        return t
 
 
 TaskstatsType = netlink.create_attr_list_type(
@@ -91,10 +92,13 @@ class TaskstatsClient(object):
     def __init__(self, verbose=False):
         self.verbose = verbose
         self.nlsock = netlink.NetlinkSocket()
+        # get_pid_stats is usually called for lots of pids in a row, and
+        # only the pid changes from one request to the next.
+        self._get_pid_tmpl = netlink.MessageTemplate(TaskstatsMessage(
+            'GET', flags=netlink.MessageFlags.ACK_REQUEST,
+            attr_list=TaskstatsAttrList(pid=0)
+        ), 'pid')
 
     def get_pid_stats(self, pid):
-        replies = self.nlsock.query(TaskstatsMessage(
-            'GET', flags=netlink.MessageFlags.ACK_REQUEST,
-            attr_list=TaskstatsAttrList(pid=pid)
-        ))
+        replies = self.nlsock.query(self._get_pid_tmpl.message(pid=pid))
         return replies[0].get_attr_list().get('aggr_pid').get('stats')
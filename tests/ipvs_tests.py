@@ -1,17 +1,14 @@
 #!/usr/bin/env python
 
-from __future__ import absolute_import
-from __future__ import division
-from __future__ import print_function
-from __future__ import unicode_literals
-
 from gnlpy.ipvs import IpvsClient
 from gnlpy import ipvs
 
 import json
-import six
+import re
 import socket
+import threading
 import unittest
+from unittest import mock
 
 
 class BaseIpvsTestCase(unittest.TestCase):
@@ -38,25 +35,15 @@ class BaseIpvsTestCase(unittest.TestCase):
         '''
         helper function that clear ALL services from ipvs
         '''
-        pools = self.client.get_pools()
-        for pool in pools:
-            service = pool.service()
-            if service.fwmark() is None:
-                self.client.del_service(
-                    service.vip(),
-                    service.port(),
-                    protocol=service.proto_num())
-            else:
-                self.client.del_fwm_service(service.fwmark(), af=service.af())
+        # A single IPVS_CMD_FLUSH drops every service, fwmark based or not,
+        # along with their dests.
+        self.client.flush()
 
 
-class BaseJsonTestCase(unittest.TestCase):
-    '''
-    Base class that will load pools from json.
-    This allows testing Pool, Service, Dest classes'special methods.
-    '''
-    def setUp(self, content=None):
-        content = '''[
+_SERVICE_VIP_RE = re.compile(r'^Service\(.*vip.*')
+_SERVICE_FWMARK_RE = re.compile(r'^Service\(.*fwmark.*')
+
+_DEFAULT_JSON = json.loads('''[
     {
         "service": {
             "proto": "TCP",
@@ -108,8 +95,20 @@ class BaseJsonTestCase(unittest.TestCase):
             }
         ]
     }
-]''' if content is None else content
-        self.json = json.loads(content)
+]''')
+
+
+class BaseJsonTestCase(unittest.TestCase):
+    '''
+    Base class that will load pools from json.
+    This allows testing Pool, Service, Dest classes'special methods.
+    '''
+    def setUp(self, content=None):
+        if content is None:
+            # Every test uses the same pools, so only parse them once.
+            self.json = _DEFAULT_JSON
+        else:
+            self.json = json.loads(content)
         self.pools = ipvs.Pool.load_pools_from_json_list(self.json)
 
 
@@ -213,7 +212,7 @@ class TestAddingDest(BaseIpvsTestCase):
         }
         self.client.add_service('1.1.1.1', 80)
         self.client.add_dest('1.1.1.1', 80, '2.2.2.1')
-        for k, v in six.iteritems(dest_methods):
+        for k, v in dest_methods.items():
             self.client.add_dest('1.1.1.1', 80, k, method=v)
 
         dests = self.client.get_pools()[0].dests()
@@ -274,6 +273,22 @@ class TestAddingDest(BaseIpvsTestCase):
             'Destination port should be set to 8080'
         )
 
+    def test_bulk_add_dests(self):
+        self.client.add_service('1.1.1.1', 80)
+        self.client.bulk_add_dests('1.1.1.1', 80, [
+            ipvs.Dest(ip='2.2.2.1', weight=1),
+            ipvs.Dest(ip='2.2.2.2', weight=100, port=8080,
+                      fwd_method=ipvs.IPVS_ROUTING),
+        ])
+
+        dests = sorted(self.client.get_pools()[0].dests(),
+                       key=lambda d: d.ip())
+        self.assertEqual([d.ip() for d in dests], ['2.2.2.1', '2.2.2.2'])
+        self.assertEqual([d.weight() for d in dests], [1, 100])
+        self.assertEqual([d.port() for d in dests], [80, 8080])
+        self.assertEqual([d.fwd_method() for d in dests],
+                         [ipvs.IPVS_TUNNELING, ipvs.IPVS_ROUTING])
+
 
 class TestFwmService(BaseIpvsTestCase):
 
@@ -362,15 +377,27 @@ class TestIpvsClient(BaseIpvsTestCase):
 
 
 class TestIpvsClientQuery(BaseIpvsTestCase):
+    # The service most tests look up, and its IpvsServiceAttrList.
+    srv = ipvs.Service({'vip': '1.1.1.2', 'port': 8080,
+                        'proto': 'tcp', 'sched': 'rr'})
+    srv_lst = srv.to_attr_list()
+    # Services that are never added.
+    missing_vip_lst = ipvs.Service({'vip': '1.1.1.4', 'port': 8080,
+                                    'proto': 'tcp', 'sched': 'rr'}
+                                   ).to_attr_list()
+    missing_port_lst = ipvs.Service({'vip': '1.1.1.2', 'port': 9090,
+                                     'proto': 'tcp', 'sched': 'rr'}
+                                    ).to_attr_list()
 
     def setUp(self):
         super(TestIpvsClientQuery, self).setUp()
-        self.client.add_service('1.1.1.1', 80)
-        self.client.add_dest('1.1.1.1', 80, '2.2.2.1', 80, weight=10)
-        self.client.add_dest('1.1.1.1', 80, '2.2.2.2', 80, weight=10)
-        self.client.add_service('1.1.1.2', 8080)
-        self.client.add_dest('1.1.1.2', 8080, '2.2.2.1', 8080, weight=10)
-        self.client.add_dest('1.1.1.2', 8080, '2.2.2.2', 8080, weight=10)
+        with self.client.batch():
+            self.client.add_service('1.1.1.1', 80)
+            self.client.add_dest('1.1.1.1', 80, '2.2.2.1', 80, weight=10)
+            self.client.add_dest('1.1.1.1', 80, '2.2.2.2', 80, weight=10)
+            self.client.add_service('1.1.1.2', 8080)
+            self.client.add_dest('1.1.1.2', 8080, '2.2.2.1', 8080, weight=10)
+            self.client.add_dest('1.1.1.2', 8080, '2.2.2.2', 8080, weight=10)
 
     def test_get_pools(self):
         for p in self.client.get_pools():
@@ -380,44 +407,29 @@ class TestIpvsClientQuery(BaseIpvsTestCase):
                 self.assertIn(d.ip(), ['2.2.2.1', '2.2.2.2'])
         # No services defined return an empty list
         self.client.flush()
-        self.assertEquals(self.client.get_pools(), [])
+        self.assertEqual(self.client.get_pools(), [])
 
     def test_get_service(self):
-        s = ipvs.Service({'vip': '1.1.1.2', 'port': 8080,
-                          'proto': 'tcp', 'sched': 'rr'})
-        self.assertEquals(
-            self.client.get_service(s.to_attr_list()),
-            s)
+        self.assertEqual(
+            self.client.get_service(self.srv_lst),
+            self.srv)
         # An inexistent service returns None
-        s = ipvs.Service({'vip': '1.1.1.4', 'port': 8080,
-                          'proto': 'tcp', 'sched': 'rr'})
-        self.assertEquals(self.client.get_service(s.to_attr_list()),
-                          None)
+        self.assertEqual(self.client.get_service(self.missing_vip_lst), None)
 
     def test_get_pool(self):
-        s = ipvs.Service({'vip': '1.1.1.2', 'port': 8080,
-                          'proto': 'tcp', 'sched': 'rr'})
-        p = self.client.get_pool(s.to_attr_list())
-        self.assertEquals(p.service(), s)
-        self.assertEquals(len(p.dests()), 2)
+        p = self.client.get_pool(self.srv_lst)
+        self.assertEqual(p.service(), self.srv)
+        self.assertEqual(len(p.dests()), 2)
         # An inexistent service returns None
-        s.port_ = 9090
-        self.assertEquals(self.client.get_pool(s.to_attr_list()), None)
+        self.assertEqual(self.client.get_pool(self.missing_port_lst), None)
 
     def test_get_dests(self):
-        s = ipvs.Service({'vip': '1.1.1.2', 'port': 8080,
-                          'proto': 'tcp', 'sched': 'rr'})
-        # Generate the IpvsServiceAttrList
-        srv = s.to_attr_list()
-        res = self.client.get_dests(srv)
-        self.assertEquals(len(res), 2)
-        self.assertEquals(res[0].weight(), 10)
-        self.assertEquals(res[0].fwd_method(), ipvs.IPVS_TUNNELING)
+        res = self.client.get_dests(self.srv_lst)
+        self.assertEqual(len(res), 2)
+        self.assertEqual(res[0].weight(), 10)
+        self.assertEqual(res[0].fwd_method(), ipvs.IPVS_TUNNELING)
         # An inexistent dest returns an empty list.
-        s.vip_ = '2.2.2.4'
-        # Generate new IpvsServiceAttrList
-        srv = s.to_attr_list()
-        self.assertEquals(self.client.get_dests(srv), [])
+        self.assertEqual(self.client.get_dests(self.missing_vip_lst), [])
 
 
 class TestMiscClasses(BaseJsonTestCase):
@@ -456,6 +468,18 @@ class TestMiscClasses(BaseJsonTestCase):
             d0, d2, '%s %s should be equal.' % (d0, d2)
         )
 
+    def test_keyword_construction(self):
+        d = self.pools[0].dests()[0]
+        self.assertEqual(ipvs.Dest(ip=d.ip(), weight=d.weight()), d)
+        s = self.pools[0].service()
+        self.assertEqual(
+            ipvs.Service(proto=s.proto(), vip=s.vip(), port=s.port(),
+                         sched=s.sched()),
+            s
+        )
+        # The default counters must not be shared between instances.
+        self.assertIsNot(ipvs.Dest().counters(), ipvs.Dest().counters())
+
     def test_dest_validate(self):
         sample = {
             'ip': '321.0.0.1',
@@ -518,11 +542,11 @@ class TestMiscClasses(BaseJsonTestCase):
     def test_service_repr(self):
         s = self.pools[0].service()
         # non fwmark service
-        self.assertRegexpMatches(str(s), '^Service\(.*vip.*')
+        self.assertRegex(str(s), _SERVICE_VIP_RE)
 
         s = self.pools[2].service()
         # fwmark service
-        self.assertRegexpMatches(str(s), '^Service\(.*fwmark.*')
+        self.assertRegex(str(s), _SERVICE_FWMARK_RE)
 
 
 class TestHelperFunc(unittest.TestCase):
@@ -535,7 +559,7 @@ class TestHelperFunc(unittest.TestCase):
             '1.1.1.1': True,
             '323.1.1.1': False,
         }
-        for k, v in six.iteritems(items):
+        for k, v in items.items():
             self.assertEqual(
                 ipvs._validate_ip(k), v,
                 '%s valid IP: %s' % (k, not v)
@@ -552,7 +576,7 @@ class TestHelperFunc(unittest.TestCase):
             None: None,
         }
 
-        for k, v in six.iteritems(h):
+        for k, v in h.items():
             self.assertEqual(
                 ipvs._to_proto_num(k), v,
                 '{0} is not matching the right proto num {1}'.format(k, v))
@@ -567,7 +591,7 @@ class TestHelperFunc(unittest.TestCase):
             None: None,
         }
 
-        for k, v in six.iteritems(h):
+        for k, v in h.items():
             self.assertEqual(
                 ipvs._from_proto_num(k), v,
                 'proto num {0} is not matching {1}'.format(k, v))
@@ -576,5 +600,69 @@ class TestHelperFunc(unittest.TestCase):
             ipvs._from_proto_num(socket.IPPROTO_RSVP)
 
 
+class TestMockedIpvsClient(unittest.TestCase):
+    '''
+    IpvsClient tests which don't need IPVS: the netlink socket is mocked.
+    '''
+
+    def setUp(self):
+        patcher = mock.patch.object(ipvs.netlink, 'NetlinkSocket')
+        self.nlsock = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_quiet_methods(self):
+        client = IpvsClient()
+        # Methods wrapped by @verbose are bound undecorated...
+        self.assertIs(client.add_service.__func__,
+                      IpvsClient.add_service._quiet)
+        # ...but nothing else is.
+        self.assertIs(client.batch.__func__, IpvsClient.batch)
+        # A verbose client keeps the wrappers.
+        client = IpvsClient(verbose=True)
+        self.assertIs(client.add_service.__func__, IpvsClient.add_service)
+
+    def test_batch(self):
+        client = IpvsClient()
+        with client.batch():
+            client.add_service('1.1.1.1', 80)
+            with client.batch():
+                client.add_dest('1.1.1.1', 80, '2.2.2.1')
+            client.add_dest('1.1.1.1', 80, '2.2.2.2')
+            # Nothing is sent before the outermost block ends.
+            self.assertFalse(self.nlsock.execute.called)
+            self.assertFalse(self.nlsock.execute_many.called)
+        self.nlsock.execute_many.assert_called_once_with(mock.ANY)
+        requests = self.nlsock.execute_many.call_args[0][0]
+        self.assertEqual([m.cmd for m in requests],
+                         [ipvs.IpvsMessage('new_service').cmd,
+                          ipvs.IpvsMessage('new_dest').cmd,
+                          ipvs.IpvsMessage('new_dest').cmd])
+        # Once out of the block, requests are sent right away again.
+        client.flush()
+        self.nlsock.execute.assert_called_once_with(IpvsClient._FLUSH_MSG)
+
+    def test_batch_other_thread(self):
+        client = IpvsClient()
+        with client.batch():
+            client.add_service('1.1.1.1', 80)
+            # Calls from another thread aren't queued in this batch.
+            t = threading.Thread(target=client.flush)
+            t.start()
+            t.join()
+            self.nlsock.execute.assert_called_once_with(IpvsClient._FLUSH_MSG)
+        self.assertEqual(len(self.nlsock.execute_many.call_args[0][0]), 1)
+
+    def test_bulk_add_dests_default_weight(self):
+        client = IpvsClient()
+        client.bulk_add_dests('1.1.1.1', 80, [
+            ipvs.Dest(ip='2.2.2.1', port=80),
+            ipvs.Dest(ip='2.2.2.2', port=80, weight=0),
+        ])
+        weights = [c[0][0].get_attr_list().get('dest').get('weight')
+                   for c in self.nlsock.execute.call_args_list]
+        # The kernel rejects a new dest without a weight.
+        self.assertEqual(weights, [1, 0])
+
+
 if __name__ == '__main__':
     unittest.main()
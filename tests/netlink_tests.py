@@ -1,49 +1,82 @@
 #!/usr/bin/env python
 
-from __future__ import absolute_import
-from __future__ import division
-from __future__ import print_function
-from __future__ import unicode_literals
-
 from gnlpy import netlink
 
-try:
-    from unittest import mock
-except ImportError:
-    import mock
+from unittest import mock
+import errno
 import socket
+import struct
 import unittest
 
 
+# Both test cases share these types; they are only created (and the message
+# type registered) once.
+_ATTR_LIST_TEST_FIELDS = (
+    ('U8TYPE', netlink.U8Type),
+    ('U16TYPE', netlink.U16Type),
+    ('U32TYPE', netlink.U32Type),
+    ('U64TYPE', netlink.U64Type),
+    ('I32TYPE', netlink.I32Type),
+    ('NET16TYPE', netlink.Net16Type),
+    ('NET32TYPE', netlink.Net32Type),
+    ('IGNORETYPE', netlink.IgnoreType),
+    ('BINARYTYPE', netlink.BinaryType),
+    ('NULSTRINGTYPE', netlink.NulStringType),
+    ('RECURSIVESELF', netlink.RecursiveSelf),
+)
+
+AttrListTest = netlink.create_attr_list_type(
+    'AttrListTest', *_ATTR_LIST_TEST_FIELDS)
+
+CtrlMessageTest = netlink.create_genl_message_type(
+    'CtrlMessageTest',
+    12345,
+    ('CMD1', AttrListTest),
+    ('CMD2', None),
+)
+
+
 def pack_unpack(kls, s):
     '''
     Helper function to pack an attr list and unpack it properly as if done via
     a Netlink Message.
     '''
-    return kls.unpack(kls.pack(s).tostring())
+    return kls.unpack(kls.pack(s))
+
+
+# An NLMSG_ERROR reply carrying ENOENT, followed by the header of the request
+# it answers, as the kernel sends it.
+_ENOENT_REPLY = (struct.pack('=IHHII', 36, 2, 0, 0, 0) +
+                 struct.pack('=i', -2) + b'\0' * 16)
+
+
+def _fill_enoent(buf, *args):
+    '''
+    recv_into stand-in writing _ENOENT_REPLY into the buffer.
+    '''
+    buf[:len(_ENOENT_REPLY)] = _ENOENT_REPLY
+    return len(_ENOENT_REPLY)
+
+
+def _enoent_socket():
+    '''
+    Mock netlink socket answering every request with _ENOENT_REPLY.  Only
+    what NetlinkSocket calls on its socket is there, so that nothing else
+    can be touched by accident.
+    '''
+    sock = mock.Mock(spec_set=['bind', 'getsockname', 'send', 'recv_into',
+                               'close'])
+    sock.getsockname.return_value = (0, 0)
+    sock.recv_into.side_effect = _fill_enoent
+    return sock
 
 
 class AttrListTestCase(unittest.TestCase):
     '''
     Test AttrListType class.
     '''
-    AttrListTest = netlink.create_attr_list_type(
-        'AttrListTest',
-        ('U8TYPE', netlink.U8Type),
-        ('U16TYPE', netlink.U16Type),
-        ('U32TYPE', netlink.U32Type),
-        ('U64TYPE', netlink.U64Type),
-        ('I32TYPE', netlink.I32Type),
-        ('NET16TYPE', netlink.Net16Type),
-        ('NET32TYPE', netlink.Net32Type),
-        ('IGNORETYPE', netlink.IgnoreType),
-        ('BINARYTYPE', netlink.BinaryType),
-        ('NULSTRINGTYPE', netlink.NulStringType),
-        ('RECURSIVESELF', netlink.RecursiveSelf),
-    )
-
     def test_getter_no_default(self):
-        a = self.AttrListTest()
+        a = AttrListTest()
         # Raises an exception if no default are given.
         with self.assertRaises(KeyError):
             a.get('FOO')
@@ -51,20 +84,52 @@ class AttrListTestCase(unittest.TestCase):
         self.assertEqual(a.get('FOO', 5), 5)
 
     def test_packing(self):
-        a = self.AttrListTest(
+        a = AttrListTest(
             u64type=2,
             binarytype=b'ABCD',
             nulstringtype='abcd',
         )
 
-        b = pack_unpack(self.AttrListTest, a)
+        b = pack_unpack(AttrListTest, a)
         self.assertEqual(b.get('u64type'), 2)
         self.assertEqual(b.get('binarytype'), b'ABCD')
         self.assertEqual(b.get('nulstringtype'), 'abcd')
 
+    def test_nulstring_bytes(self):
+        # Bytes are packed as is and come back as text.
+        a = AttrListTest(nulstringtype=b'abcd')
+        b = pack_unpack(AttrListTest, a)
+        self.assertEqual(b.get('nulstringtype'), 'abcd')
+
+    def test_from_tuple(self):
+        a = AttrListTest.from_tuple((1, None, 3))
+        self.assertEqual(a.get('u8type'), 1)
+        self.assertEqual(a.get('u32type'), 3)
+        # None values are left unset, as with keyword arguments.
+        self.assertEqual(a.get('u16type', None), None)
+        self.assertEqual(a.attrs, AttrListTest(u8type=1, u32type=3).attrs)
+
+    def test_attribute_access(self):
+        a = AttrListTest(u8type=1)
+        self.assertEqual(a.u8type, 1)
+        # Unset fields read as None.
+        self.assertIsNone(a.u16type)
+        a.u16type = 2
+        self.assertEqual(a.get('U16TYPE'), 2)
+        self.assertEqual(a.get('U16type'), 2)
+
+    def test_attribute_access_reserved_name(self):
+        AttrsTest = netlink.create_attr_list_type(
+            'AttrsTest', ('ATTRS', netlink.U32Type))
+        # A field can't shadow the instance's attrs dict.
+        a = AttrsTest(attrs=5)
+        self.assertEqual(a.get('attrs'), 5)
+        self.assertEqual(a.attrs, {1: 5})
+        self.assertEqual(pack_unpack(AttrsTest, a).get('attrs'), 5)
+
     def test_recursive_self(self):
-        a = self.AttrListTest(
-            recursiveself=self.AttrListTest(
+        a = AttrListTest(
+            recursiveself=AttrListTest(
                 nulstringtype='abcd',
             )
         )
@@ -72,7 +137,7 @@ class AttrListTestCase(unittest.TestCase):
         self.assertEqual(a.get('recursiveself').get('nulstringtype'), 'abcd')
 
         # Confirmd that we can properly pack and unpack the AttrListType.
-        b = pack_unpack(self.AttrListTest, a)
+        b = pack_unpack(AttrListTest, a)
         self.assertEqual(b.get('recursiveself').get('nulstringtype'), 'abcd')
 
 
@@ -80,53 +145,62 @@ class MessageTypeTestCase(unittest.TestCase):
     '''
     Test MessageType class.
     '''
-    AttrListTest = netlink.create_attr_list_type(
-        'AttrListTest',
-        ('U8TYPE', netlink.U8Type),
-        ('U16TYPE', netlink.U16Type),
-        ('U32TYPE', netlink.U32Type),
-        ('U64TYPE', netlink.U64Type),
-        ('I32TYPE', netlink.I32Type),
-        ('NET16TYPE', netlink.Net16Type),
-        ('NET32TYPE', netlink.Net32Type),
-        ('IGNORETYPE', netlink.IgnoreType),
-        ('BINARYTYPE', netlink.BinaryType),
-        ('NULSTRINGTYPE', netlink.NulStringType),
-        ('RECURSIVESELF', netlink.RecursiveSelf),
-    )
-
-    CtrlMessageTest = netlink.create_genl_message_type(
-        'CtrlMessageTest',
-        12345,
-        ('CMD1', AttrListTest),
-        ('CMD2', None),
-    )
-
     def test_msg_type_init(self):
-        attr = self.AttrListTest()
+        attr = AttrListTest()
         # Raises a KeyError when the command is not supported by the message.
         with self.assertRaises(KeyError):
-            self.CtrlMessageTest('CMD', attr_list=attr)
+            CtrlMessageTest('CMD', attr_list=attr)
 
         # A message can be initialized with a CMD string
-        ctrl = self.CtrlMessageTest('CMD1', attr_list=attr)
+        ctrl = CtrlMessageTest('CMD1', attr_list=attr)
         self.assertEqual(ctrl.cmd, 1)
 
         # Or a command ID.
-        ctrl2 = self.CtrlMessageTest(1, attr_list=attr)
+        ctrl2 = CtrlMessageTest(1, attr_list=attr)
         self.assertEqual(ctrl.cmd, ctrl2.cmd)
 
+        # Or the per-command constructor.
+        ctrl3 = CtrlMessageTest.CMD1(attr_list=attr)
+        self.assertEqual(ctrl.cmd, ctrl3.cmd)
+        self.assertIs(ctrl3.attr_list, attr)
+
         # When initialized without an attribute list, it will create a default
         # attr_list for us.
-        ctrl = self.CtrlMessageTest('CMD1')
-        self.assertIsInstance(ctrl.attr_list, self.AttrListTest)
+        ctrl = CtrlMessageTest('CMD1')
+        self.assertIsInstance(ctrl.attr_list, AttrListTest)
         # Unless the operation is not supported
-        ctrl = self.CtrlMessageTest('CMD2')
+        ctrl = CtrlMessageTest('CMD2')
         self.assertIsNone(ctrl.attr_list)
 
+    def test_message_template(self):
+        tmpl = netlink.MessageTemplate(CtrlMessageTest(
+            'CMD1', attr_list=AttrListTest(
+                u32type=0, nulstringtype='abcd')), 'u32type')
+        msg = tmpl.message(u32type=7)
+        expected = CtrlMessageTest('CMD1', attr_list=AttrListTest(
+            u32type=7, nulstringtype='abcd'))
+        self.assertEqual(
+            bytes(netlink.serialize_message(msg, 1, 2)),
+            bytes(netlink.serialize_message(expected, 1, 2))
+        )
+
+    def test_error_message(self):
+        request = netlink.serialize_message(CtrlMessageTest('CMD1'), 1, 2)
+        # ErrorMessage can't be packed, so build the reply by hand: an error
+        # code followed by the request it answers.
+        body = struct.pack('=i', -2) + request
+        reply = bytearray(
+            struct.pack('=IHHII', 16 + len(body), 2, 0, 2, 1) + body)
+        # Messages are unpacked from a view of NetlinkSocket's receive buffer.
+        msg, _ = netlink.deserialize_message_from(memoryview(reply))
+        self.assertEqual(msg.error, -2)
+        self.assertEqual(msg.msg[0].cmd, 1)
+        # Nothing in the message refers back to the buffer.
+        self.assertIs(type(msg.msg[1]), bytes)
+
     def test_get_attr_list(self):
-        ctrl = self.CtrlMessageTest('CMD1')
-        self.assertIsInstance(ctrl.get_attr_list(), self.AttrListTest)
+        ctrl = CtrlMessageTest('CMD1')
+        self.assertIsInstance(ctrl.get_attr_list(), AttrListTest)
 
     def test_assert_on_message_redefinition(self):
         # Assert when redefining a MessageType
@@ -143,21 +217,35 @@ class MessageTypeTestCase(unittest.TestCase):
     def test_new_message_by_name(self):
         # It is fine to create a message by using a family name.
         # It will be looked up later.
-        netlink.create_genl_message_type('Foo', 'BAR')
-        # But we should not be able to register twice!
+        foo = netlink.create_genl_message_type('Foo', 'BAR')
+        # Asking for the same message type again gives back the same class.
+        self.assertIs(netlink.create_genl_message_type('Foo', 'BAR'), foo)
+        # But we should not be able to register a different one!
         with self.assertRaises(AssertionError):
-            netlink.create_genl_message_type('Foo', 'BAR')
+            netlink.create_genl_message_type('Foo', 'BAR', ('CMD1', None))
+
+    def test_attr_list_type_memoized(self):
+        # Creating the same attr list type again gives back the same class.
+        self.assertIs(
+            netlink.create_attr_list_type(
+                'AttrListTest', *_ATTR_LIST_TEST_FIELDS),
+            AttrListTest)
+        # Fields can be given as lists too.
+        self.assertIs(
+            netlink.create_attr_list_type(
+                'AttrListTest', *[list(f) for f in _ATTR_LIST_TEST_FIELDS]),
+            AttrListTest)
 
     def test_packing(self):
-        attr = self.AttrListTest(
+        attr = AttrListTest(
             u64type=2,
             binarytype=b'ABCD',
             nulstringtype='abcd',
         )
 
-        ctrl = self.CtrlMessageTest('CMD1', attr_list=attr)
+        ctrl = CtrlMessageTest('CMD1', attr_list=attr)
         self.assertEqual(ctrl.cmd, 1)
-        ctrl2 = pack_unpack(self.CtrlMessageTest, ctrl)
+        ctrl2 = pack_unpack(CtrlMessageTest, ctrl)
         # Check that we have the same command.
         self.assertEqual(ctrl.cmd, ctrl2.cmd)
         # And that we have the same attributes.
@@ -179,19 +267,59 @@ class NetlinkSocketTestCase(unittest.TestCase):
         mock_method.assert_called_once_with('BAR')
 
     def test_msg_query_exception_verbose(self):
-        self.sock = mock.MagicMock(name='netlink.socket', spec=socket.socket)
-        self.sock.recv.return_value = 'AAA'
-        sock = netlink.NetlinkSocket(verbose=True)
-        with self.assertRaises(AttributeError):
-            sock.query('a')
+        mock_sock = _enoent_socket()
+        with mock.patch.object(socket, 'socket', return_value=mock_sock):
+            sock = netlink.NetlinkSocket(verbose=True)
+        with self.assertRaisesRegex(RuntimeError, 'ENOENT'):
+            sock.query(CtrlMessageTest('CMD1'))
+        self.assertTrue(mock_sock.send.called)
+        self.assertTrue(mock_sock.recv_into.called)
         sock.close()
 
     def test_msg_execute_exception_verbose(self):
-        self.sock = mock.MagicMock(name='netlink.socket', spec=socket.socket)
-        self.sock.recv.return_value = 'AAA'
-        sock = netlink.NetlinkSocket(verbose=True)
-        with self.assertRaises(AttributeError):
-            sock.execute('a')
+        mock_sock = _enoent_socket()
+        with mock.patch.object(socket, 'socket', return_value=mock_sock):
+            sock = netlink.NetlinkSocket(verbose=True)
+        with self.assertRaises(OSError) as cm:
+            sock.execute(CtrlMessageTest('CMD1'))
+        self.assertEqual(cm.exception.errno, errno.ENOENT)
+        self.assertTrue(mock_sock.send.called)
+        self.assertTrue(mock_sock.recv_into.called)
+        sock.close()
+
+    def test_query_many(self):
+        with mock.patch.object(
+                netlink.NetlinkSocket,
+                'resolve_family',
+                return_value=5):
+            sock = netlink.NetlinkSocket()
+        ok = [mock.sentinel.reply]
+        err = [netlink.ErrorMessage(error=-2, msg=None)]
+        with mock.patch.object(sock, '_send') as mock_send:
+            with mock.patch.object(sock, '_recv', side_effect=[ok, err]):
+                # A failed request gets None, the others still get replies.
+                self.assertEqual(sock.query_many(['a', 'b']), [ok, None])
+        self.assertEqual(mock_send.call_count, 2)
+        sock.close()
+
+    def test_execute_many(self):
+        with mock.patch.object(
+                netlink.NetlinkSocket,
+                'resolve_family',
+                return_value=5):
+            sock = netlink.NetlinkSocket()
+        ack = [netlink.ErrorMessage(error=0, msg=None)]
+        err = [netlink.ErrorMessage(error=-2, msg=None)]
+        with mock.patch.object(sock, 'sock') as mock_sock:
+            with mock.patch.object(sock, '_recv',
+                                   side_effect=[err, ack]) as mock_recv:
+                # The first error is raised once every ack has been read.
+                with self.assertRaises(OSError):
+                    sock.execute_many([CtrlMessageTest('CMD1'),
+                                       CtrlMessageTest('CMD1')])
+        # Both requests went out in a single write.
+        self.assertEqual(mock_sock.send.call_count, 1)
+        self.assertEqual(mock_recv.call_count, 2)
         sock.close()
 
 